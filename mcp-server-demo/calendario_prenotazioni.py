@@ -3,170 +3,309 @@ Sistema di Gestione Calendario Prenotazioni
 Database SQLite per la gestione di appuntamenti e clienti
 """
 
+import os
 import sqlite3
-from datetime import datetime, timedelta
-import random
 
-def crea_database():
+# Path del database
+DB_PATH = 'calendario_prenotazioni.db'
+
+# Schema (tabelle e trigger), eseguito con un solo executescript
+SCHEMA_SQL = '''
+BEGIN IMMEDIATE;
+
+-- Tabella CATEGORIE (opzionale, per classificare gli appuntamenti)
+CREATE TABLE IF NOT EXISTS categorie (
+    id_categoria INTEGER PRIMARY KEY AUTOINCREMENT,
+    nome_categoria TEXT NOT NULL UNIQUE,
+    descrizione TEXT,
+    colore TEXT
+);
+
+-- Tabella APPUNTAMENTI
+CREATE TABLE IF NOT EXISTS appuntamenti (
+    id_appuntamento INTEGER PRIMARY KEY AUTOINCREMENT,
+    titolo TEXT NOT NULL,
+    descrizione TEXT,
+    data_appuntamento DATE NOT NULL,
+    ora_inizio TIME,
+    ora_fine TIME,
+    id_categoria INTEGER,
+    priorita TEXT DEFAULT 'media',
+    priorita_rank INTEGER GENERATED ALWAYS AS (
+        CASE priorita
+            WHEN 'critica' THEN 1
+            WHEN 'alta' THEN 2
+            WHEN 'media' THEN 3
+            WHEN 'bassa' THEN 4
+        END
+    ) STORED,
+    difficolta INTEGER DEFAULT 3,
+    tempo_stimato_ore REAL,
+    stato TEXT DEFAULT 'da_fare',
+    urgente BOOLEAN DEFAULT 0,
+    note TEXT,
+    data_creazione TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    data_modifica TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    data_completamento TIMESTAMP,
+    FOREIGN KEY (id_categoria) REFERENCES categorie(id_categoria),
+    CHECK (priorita IN ('bassa', 'media', 'alta', 'critica')),
+    CHECK (stato IN ('da_fare', 'in_corso', 'completato', 'cancellato', 'posticipato')),
+    CHECK (difficolta BETWEEN 1 AND 10)
+);
+
+-- Tabella STORICO_MODIFICHE (per tracciare le modifiche agli appuntamenti)
+CREATE TABLE IF NOT EXISTS storico_modifiche (
+    id_modifica INTEGER PRIMARY KEY AUTOINCREMENT,
+    id_appuntamento INTEGER NOT NULL,
+    tipo_modifica TEXT NOT NULL,
+    descrizione_modifica TEXT,
+    data_modifica TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (id_appuntamento) REFERENCES appuntamenti(id_appuntamento)
+);
+
+-- Tabella STATO_COUNTS (conteggio task per stato, aggiornato dai trigger)
+CREATE TABLE IF NOT EXISTS stato_counts (
+    stato TEXT PRIMARY KEY,
+    n INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TRIGGER IF NOT EXISTS trg_stato_counts_insert
+AFTER INSERT ON appuntamenti
+BEGIN
+    INSERT INTO stato_counts (stato, n) VALUES (NEW.stato, 1)
+    ON CONFLICT(stato) DO UPDATE SET n = n + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_stato_counts_delete
+AFTER DELETE ON appuntamenti
+BEGIN
+    UPDATE stato_counts SET n = n - 1 WHERE stato = OLD.stato;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_stato_counts_update
+AFTER UPDATE OF stato ON appuntamenti
+WHEN OLD.stato IS NOT NEW.stato
+BEGIN
+    UPDATE stato_counts SET n = n - 1 WHERE stato = OLD.stato;
+    INSERT INTO stato_counts (stato, n) VALUES (NEW.stato, 1)
+    ON CONFLICT(stato) DO UPDATE SET n = n + 1;
+END;
+
+COMMIT;
+'''
+
+# Indici e trigger dello storico, creati dopo il caricamento massivo dei
+# dati (vedi crea_indici)
+INDICI_SQL = '''
+BEGIN IMMEDIATE;
+
+-- Indici per migliorare le performance
+CREATE INDEX IF NOT EXISTS idx_appuntamenti_data ON appuntamenti(data_appuntamento);
+CREATE INDEX IF NOT EXISTS idx_appuntamenti_priorita ON appuntamenti(priorita);
+CREATE INDEX IF NOT EXISTS idx_app_stato_data ON appuntamenti(stato, data_appuntamento);
+
+-- Indice parziale con lo stesso ordinamento della query "prossimi task"
+CREATE INDEX IF NOT EXISTS idx_app_priority ON appuntamenti(
+    urgente DESC,
+    priorita_rank,
+    data_appuntamento,
+    ora_inizio
+)
+WHERE stato != 'completato';
+
+-- Voce 'creazione' nello storico per ogni nuovo task, come in main.py;
+-- creato dopo il caricamento, i task di esempio non hanno storico
+CREATE TRIGGER IF NOT EXISTS trg_storico_creazione AFTER INSERT ON appuntamenti BEGIN
+    INSERT INTO storico_modifiche (id_appuntamento, tipo_modifica, descrizione_modifica)
+    VALUES (new.id_appuntamento, 'creazione', 'Task creato');
+END;
+
+-- Statistiche aggiornate per il query planner (sqlite_stat1)
+ANALYZE;
+
+COMMIT;
+'''
+
+# INSERT multi-riga delle categorie: {valori} riceve un gruppo di
+# segnaposto per ogni categoria
+_SQL_INS_CAT = '''
+    INSERT OR IGNORE INTO categorie (nome_categoria, descrizione, colore)
+    VALUES {valori}
+    RETURNING id_categoria, nome_categoria
+'''
+
+# Generazione degli appuntamenti di esempio interamente in SQL: da 0 a 3 task
+# per ciascuno dei prossimi N giorni, scelti a caso dal pool di task di esempio
+_SQL_GENERA_APP = '''
+    INSERT INTO appuntamenti (titolo, descrizione, data_appuntamento, ora_inizio, ora_fine,
+                             id_categoria, priorita, difficolta, tempo_stimato_ore, 
+                             stato, urgente, note, data_completamento)
+    WITH RECURSIVE
+        giorni(d) AS (
+            SELECT 0
+            UNION ALL
+            SELECT d + 1 FROM giorni WHERE d + 1 < ?
+        ),
+        task_pool(idx, titolo, descrizione, id_categoria, priorita,
+                  difficolta, tempo_ore, urgente) AS (
+            VALUES {task_pool}
+        ),
+        slot(j) AS (
+            VALUES (0), (1), (2)
+        ),
+        num_task_giorno(d, n) AS MATERIALIZED (
+            SELECT d, abs(random()) % 4 FROM giorni
+        ),
+        estrazioni(d, idx, ora_h, ora_m, stato, ore_completamento) AS MATERIALIZED (
+            SELECT
+                g.d,
+                abs(random()) % (SELECT COUNT(*) FROM task_pool),
+                8 + abs(random()) % 11,
+                15 * (abs(random()) % 4),
+                CASE abs(random()) % 5
+                    WHEN 3 THEN 'in_corso'
+                    WHEN 4 THEN 'completato'
+                    ELSE 'da_fare'
+                END,
+                1 + abs(random()) % 48
+            FROM num_task_giorno g
+            JOIN slot s ON s.j < g.n
+        ),
+        righe AS (
+            SELECT e.*, t.*,
+                   (e.ora_h * 60 + e.ora_m + CAST(t.tempo_ore * 60 AS INTEGER)) % 1440 AS fine_min
+            FROM estrazioni e
+            JOIN task_pool t ON t.idx = e.idx
+        )
+    SELECT
+        titolo,
+        descrizione,
+        date('now', 'localtime', '+' || d || ' days'),
+        printf('%02d:%02d', ora_h, ora_m),
+        CASE WHEN tempo_ore THEN printf('%02d:%02d', fine_min / 60, fine_min % 60) END,
+        id_categoria,
+        priorita,
+        difficolta,
+        tempo_ore,
+        stato,
+        urgente,
+        '',
+        CASE WHEN stato = 'completato'
+            THEN strftime('%Y-%m-%dT%H:%M:%S', 'now', 'localtime',
+                          '+' || d || ' days', '-' || ore_completamento || ' hours')
+        END
+    FROM righe
+    ORDER BY d
+'''
+
+# Prossimi task da fare con un dato flag di urgenza
+_SQL_PROSSIMI_TASK = '''
+    SELECT 
+        data_appuntamento,
+        ora_inizio,
+        titolo,
+        priorita,
+        urgente
+    FROM appuntamenti
+    WHERE urgente = ?
+    AND data_appuntamento >= date('now')
+    AND stato != 'completato'
+    ORDER BY 
+        priorita_rank,
+        data_appuntamento,
+        ora_inizio
+    LIMIT ?
+'''
+
+# Priorità ammesse, nell'ordine di priorita_rank (1 = critica)
+PRIORITA = ('critica', 'alta', 'media', 'bassa')
+
+def crea_schema():
     """Crea il database e le tabelle necessarie"""
     
-    # Connessione al database
-    conn = sqlite3.connect('calendario_prenotazioni.db')
+    # Il database viene costruito in memoria e scritto su file alla fine
+    # (vedi salva_database), transazioni gestite esplicitamente
+    conn = sqlite3.connect(':memory:', isolation_level=None)
     cursor = conn.cursor()
     
-    # Tabella CATEGORIE (opzionale, per classificare gli appuntamenti)
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS categorie (
-            id_categoria INTEGER PRIMARY KEY AUTOINCREMENT,
-            nome_categoria TEXT NOT NULL UNIQUE,
-            descrizione TEXT,
-            colore TEXT
-        )
-    ''')
-    
-    # Tabella APPUNTAMENTI
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS appuntamenti (
-            id_appuntamento INTEGER PRIMARY KEY AUTOINCREMENT,
-            titolo TEXT NOT NULL,
-            descrizione TEXT,
-            data_appuntamento DATE NOT NULL,
-            ora_inizio TIME,
-            ora_fine TIME,
-            id_categoria INTEGER,
-            priorita TEXT DEFAULT 'media',
-            difficolta INTEGER DEFAULT 3,
-            tempo_stimato_ore REAL,
-            stato TEXT DEFAULT 'da_fare',
-            urgente BOOLEAN DEFAULT 0,
-            note TEXT,
-            data_creazione TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            data_modifica TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            data_completamento TIMESTAMP,
-            FOREIGN KEY (id_categoria) REFERENCES categorie(id_categoria),
-            CHECK (priorita IN ('bassa', 'media', 'alta', 'critica')),
-            CHECK (stato IN ('da_fare', 'in_corso', 'completato', 'cancellato', 'posticipato')),
-            CHECK (difficolta BETWEEN 1 AND 10)
-        )
-    ''')
-    
-    # Tabella STORICO_MODIFICHE (per tracciare le modifiche agli appuntamenti)
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS storico_modifiche (
-            id_modifica INTEGER PRIMARY KEY AUTOINCREMENT,
-            id_appuntamento INTEGER NOT NULL,
-            tipo_modifica TEXT NOT NULL,
-            descrizione_modifica TEXT,
-            data_modifica TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (id_appuntamento) REFERENCES appuntamenti(id_appuntamento)
-        )
-    ''')
+    # PRAGMA per velocizzare il caricamento
+    cursor.execute('PRAGMA temp_store=MEMORY')
+    cursor.execute('PRAGMA cache_size=-64000')
     
-    # Indici per migliorare le performance
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_appuntamenti_data ON appuntamenti(data_appuntamento)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_appuntamenti_priorita ON appuntamenti(priorita)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_appuntamenti_stato ON appuntamenti(stato)')
+    # Tabelle e trigger in un unico script
+    cursor.executescript(SCHEMA_SQL)
     
-    conn.commit()
     print("✓ Database e tabelle creati con successo")
     
     return conn, cursor
 
-def inserisci_dati_esempio(conn, cursor):
-    """Inserisce dati di esempio nel database"""
-    
-    # Categorie
-    categorie = [
-        ('Lavoro', 'Task lavorativi', '#3498db'),
-        ('Studio', 'Attività di studio e apprendimento', '#9b59b6'),
-        ('Personale', 'Impegni personali', '#2ecc71'),
-        ('Salute', 'Visite mediche e fitness', '#e74c3c'),
-        ('Casa', 'Lavori domestici e manutenzione', '#f39c12'),
-        ('Famiglia', 'Tempo con famiglia e amici', '#1abc9c'),
-    ]
-    
-    cursor.executemany('''
-        INSERT OR IGNORE INTO categorie (nome_categoria, descrizione, colore)
-        VALUES (?, ?, ?)
-    ''', categorie)
+def crea_indici(cursor):
+    """Crea gli indici, il trigger dello storico e aggiorna le statistiche,
+    dopo l'inserimento dei dati
     
-    # Appuntamenti di esempio
-    base_date = datetime.now()
-    appuntamenti = []
-    
-    # Task di esempio realistici
-    task_examples = [
-        ("Riunione team", "Riunione settimanale con il team di progetto", "Lavoro", "alta", 5, 2.0, False),
-        ("Palestra", "Allenamento cardio e pesi", "Salute", "media", 3, 1.5, False),
-        ("Spesa settimanale", "Comprare generi alimentari per la settimana", "Personale", "bassa", 2, 1.0, False),
-        ("Studiare Python", "Completare corso online su machine learning", "Studio", "alta", 7, 3.0, False),
-        ("Dentista", "Controllo semestrale", "Salute", "media", 2, 1.0, False),
-        ("Presentazione cliente", "Preparare e presentare proposta", "Lavoro", "critica", 8, 4.0, True),
-        ("Riparare rubinetto", "Chiamare idraulico per perdita", "Casa", "alta", 4, 0.5, True),
-        ("Compleanno mamma", "Organizzare cena di compleanno", "Famiglia", "alta", 6, 3.0, False),
-        ("Report mensile", "Completare report per il management", "Lavoro", "alta", 6, 2.5, False),
-        ("Yoga", "Lezione di yoga online", "Salute", "bassa", 2, 1.0, False),
-        ("Corso inglese", "Lezione settimanale di inglese", "Studio", "media", 4, 1.5, False),
-        ("Pagare bollette", "Pagamento utenze mensili", "Personale", "alta", 1, 0.5, True),
-    ]
-    
-    # Mappa categorie
-    categoria_map = {cat[0]: i+1 for i, cat in enumerate(categorie)}
+    Costruire ogni indice una volta sui dati già caricati costa meno che
+    aggiornarlo a ogni riga inserita; ANALYZE permette al planner di
+    scegliere i nuovi indici.
+    """
+    cursor.executescript(INDICI_SQL)
+    print("✓ Indici creati")
+
+def inserisci_dati_esempio(conn, cursor, giorni=30):
+    """Inserisce dati di esempio nel database per i prossimi giorni"""
     
-    # Genera appuntamenti per i prossimi 30 giorni
-    for i in range(30):
-        num_task_giorno = random.randint(0, 3)
-        data = base_date + timedelta(days=i)
+    # Un'unica transazione per tutto il popolamento
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        # Categorie
+        categorie = [
+            ('Lavoro', 'Task lavorativi', '#3498db'),
+            ('Studio', 'Attività di studio e apprendimento', '#9b59b6'),
+            ('Personale', 'Impegni personali', '#2ecc71'),
+            ('Salute', 'Visite mediche e fitness', '#e74c3c'),
+            ('Casa', 'Lavori domestici e manutenzione', '#f39c12'),
+            ('Famiglia', 'Tempo con famiglia e amici', '#1abc9c'),
+        ]
         
-        for j in range(num_task_giorno):
-            task = random.choice(task_examples)
-            titolo, descrizione, categoria, priorita, difficolta, tempo_ore, urgente = task
-            
-            # Genera orario casuale
-            ora_inizio_h = random.randint(8, 18)
-            ora_inizio_m = random.choice([0, 15, 30, 45])
-            ora_inizio = f"{ora_inizio_h:02d}:{ora_inizio_m:02d}"
-            
-            # Calcola ora fine basata sul tempo stimato
-            if tempo_ore:
-                fine_dt = datetime.strptime(ora_inizio, '%H:%M') + timedelta(hours=tempo_ore)
-                ora_fine = fine_dt.strftime('%H:%M')
-            else:
-                ora_fine = None
-            
-            stato = random.choice(['da_fare', 'da_fare', 'da_fare', 'in_corso', 'completato'])
-            
-            # Se completato, aggiungi data completamento
-            data_completamento = None
-            if stato == 'completato':
-                data_completamento = (data - timedelta(hours=random.randint(1, 48))).isoformat()
-            
-            appuntamenti.append((
-                titolo,
-                descrizione,
-                data.strftime('%Y-%m-%d'),
-                ora_inizio,
-                ora_fine,
-                categoria_map.get(categoria, 1),
-                priorita,
-                difficolta,
-                tempo_ore,
-                stato,
-                1 if urgente else 0,
-                "",  # note
-                data_completamento
-            ))
-    
-    cursor.executemany('''
-        INSERT INTO appuntamenti (titolo, descrizione, data_appuntamento, ora_inizio, ora_fine,
-                                 id_categoria, priorita, difficolta, tempo_stimato_ore, 
-                                 stato, urgente, note, data_completamento)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', appuntamenti)
+        # Tabella piccola e fissa: un solo INSERT multi-riga, che restituisce
+        # gli ID effettivamente assegnati (il database in memoria è sempre nuovo)
+        valori = ", ".join(["(?, ?, ?)"] * len(categorie))
+        cursor.execute(_SQL_INS_CAT.format(valori=valori),
+                       [v for cat in categorie for v in cat])
+        categoria_map = {nome: cid for cid, nome in cursor.fetchall()}
+        
+        # Task di esempio realistici
+        task_examples = [
+            ("Riunione team", "Riunione settimanale con il team di progetto", "Lavoro", "alta", 5, 2.0, False),
+            ("Palestra", "Allenamento cardio e pesi", "Salute", "media", 3, 1.5, False),
+            ("Spesa settimanale", "Comprare generi alimentari per la settimana", "Personale", "bassa", 2, 1.0, False),
+            ("Studiare Python", "Completare corso online su machine learning", "Studio", "alta", 7, 3.0, False),
+            ("Dentista", "Controllo semestrale", "Salute", "media", 2, 1.0, False),
+            ("Presentazione cliente", "Preparare e presentare proposta", "Lavoro", "critica", 8, 4.0, True),
+            ("Riparare rubinetto", "Chiamare idraulico per perdita", "Casa", "alta", 4, 0.5, True),
+            ("Compleanno mamma", "Organizzare cena di compleanno", "Famiglia", "alta", 6, 3.0, False),
+            ("Report mensile", "Completare report per il management", "Lavoro", "alta", 6, 2.5, False),
+            ("Yoga", "Lezione di yoga online", "Salute", "bassa", 2, 1.0, False),
+            ("Corso inglese", "Lezione settimanale di inglese", "Studio", "media", 4, 1.5, False),
+            ("Pagare bollette", "Pagamento utenze mensili", "Personale", "alta", 1, 0.5, True),
+        ]
+        
+        # Appuntamenti generati da SQLite con un solo INSERT ... SELECT
+        task_pool = ", ".join(["(?, ?, ?, ?, ?, ?, ?, ?)"] * len(task_examples))
+        params = [giorni]
+        for idx, (titolo, descrizione, categoria, priorita, difficolta,
+                  tempo_ore, urgente) in enumerate(task_examples):
+            params += [idx, titolo, descrizione, categoria_map.get(categoria, 1),
+                       priorita, difficolta, tempo_ore, 1 if urgente else 0]
+        cursor.execute(_SQL_GENERA_APP.format(task_pool=task_pool), params)
+        num_appuntamenti = cursor.rowcount
+        
+        cursor.execute('COMMIT')
+    except Exception:
+        cursor.execute('ROLLBACK')
+        raise
     
-    conn.commit()
     print(f"✓ Inserite {len(categorie)} categorie")
-    print(f"✓ Inseriti {len(appuntamenti)} appuntamenti/task")
+    print(f"✓ Inseriti {num_appuntamenti} appuntamenti/task")
 
 def mostra_statistiche(cursor):
     """Mostra statistiche del database"""
@@ -174,68 +313,49 @@ def mostra_statistiche(cursor):
     print("STATISTICHE DATABASE")
     print("="*60)
     
-    # Totale appuntamenti
-    cursor.execute('SELECT COUNT(*) FROM appuntamenti')
-    print(f"Totale task: {cursor.fetchone()[0]}")
-    
-    # Per stato
+    # Totale, urgenti e per priorità in un'unica scansione
     cursor.execute('''
-        SELECT stato, COUNT(*) as num 
-        FROM appuntamenti 
-        GROUP BY stato
-        ORDER BY num DESC
+        SELECT 
+            COUNT(*),
+            SUM(urgente = 1),
+            SUM(priorita_rank = 1),
+            SUM(priorita_rank = 2),
+            SUM(priorita_rank = 3),
+            SUM(priorita_rank = 4)
+        FROM appuntamenti
     ''')
+    totale, urgenti, *conteggi = [n or 0 for n in cursor.fetchone()]
+    # Rank 1..4 -> nome della priorità
+    per_priorita = dict(zip(PRIORITA, conteggi))
+    
+    print(f"Totale task: {totale}")
+    
+    # Per stato (dalla tabella riepilogativa mantenuta dai trigger)
+    cursor.execute('SELECT stato, n FROM stato_counts WHERE n > 0 ORDER BY n DESC')
     print("\nTask per stato:")
     for row in cursor.fetchall():
         print(f"  - {row[0]}: {row[1]}")
     
     # Per priorità
-    cursor.execute('''
-        SELECT priorita, COUNT(*) as num 
-        FROM appuntamenti 
-        GROUP BY priorita
-        ORDER BY 
-            CASE priorita
-                WHEN 'critica' THEN 1
-                WHEN 'alta' THEN 2
-                WHEN 'media' THEN 3
-                WHEN 'bassa' THEN 4
-            END
-    ''')
     print("\nTask per priorità:")
-    for row in cursor.fetchall():
-        print(f"  - {row[0]}: {row[1]}")
+    for priorita, num in per_priorita.items():
+        if num:
+            print(f"  - {priorita}: {num}")
     
     # Urgenti
-    cursor.execute('SELECT COUNT(*) FROM appuntamenti WHERE urgente = 1')
-    print(f"\nTask urgenti: {cursor.fetchone()[0]}")
+    print(f"\nTask urgenti: {urgenti}")
     
-    # Prossimi 5 task da fare
-    cursor.execute('''
-        SELECT 
-            data_appuntamento,
-            ora_inizio,
-            titolo,
-            priorita,
-            urgente
-        FROM appuntamenti
-        WHERE data_appuntamento >= date('now')
-        AND stato != 'completato'
-        ORDER BY 
-            urgente DESC,
-            CASE priorita
-                WHEN 'critica' THEN 1
-                WHEN 'alta' THEN 2
-                WHEN 'media' THEN 3
-                WHEN 'bassa' THEN 4
-            END,
-            data_appuntamento,
-            ora_inizio
-        LIMIT 5
-    ''')
+    # Prossimi 5 task da fare: prima gli urgenti, poi (solo se servono) gli
+    # altri; ogni ricerca percorre un indice già ordinato e si ferma a LIMIT
+    prossimi = []
+    for urgente in (1, 0):
+        cursor.execute(_SQL_PROSSIMI_TASK, (urgente, 5 - len(prossimi)))
+        prossimi += cursor.fetchall()
+        if len(prossimi) >= 5:
+            break
     
     print("\nProssimi 5 task (per priorità e urgenza):")
-    for row in cursor.fetchall():
+    for row in prossimi:
         urgente_marker = " 🚨" if row[4] else ""
         priorita_emoji = {'critica': '🔴', 'alta': '🟠', 'media': '🟡', 'bassa': '🟢'}.get(row[3], '')
         orario = f" alle {row[1]}" if row[1] else ""
@@ -243,6 +363,34 @@ def mostra_statistiche(cursor):
     
     print("="*60 + "\n")
 
+def salva_database(conn):
+    """Scrive il database in memoria sul file DB_PATH
+    
+    VACUUM INTO scrive un file temporaneo che poi sostituisce DB_PATH con
+    os.replace. Il file precedente, che il server MCP usa in modalità WAL,
+    viene prima riportato in journal_mode=DELETE: SQLite lo consente solo
+    se nessun'altra connessione è aperta e intanto riversa nel file le
+    scritture ancora nel WAL. Se il database è in uso non si tocca nulla.
+    """
+    temp = DB_PATH + '.nuovo'
+    if os.path.exists(temp):
+        os.remove(temp)
+    conn.execute('VACUUM INTO ?', (temp,))
+    
+    if os.path.exists(DB_PATH):
+        vecchio = sqlite3.connect(DB_PATH, timeout=0)
+        try:
+            vecchio.execute('PRAGMA journal_mode=DELETE')
+        except sqlite3.OperationalError as e:
+            os.remove(temp)
+            raise RuntimeError(
+                f"{DB_PATH} è in uso (server MCP avviato?), non sostituito: {e}"
+            ) from e
+        finally:
+            vecchio.close()
+    
+    os.replace(temp, DB_PATH)
+
 def main():
     """Funzione principale"""
     print("\n" + "="*60)
@@ -250,19 +398,27 @@ def main():
     print("="*60 + "\n")
     
     # Crea database e tabelle
-    conn, cursor = crea_database()
+    conn, cursor = crea_schema()
     
     # Inserisci dati di esempio
     print("\nInserimento dati di esempio...")
     inserisci_dati_esempio(conn, cursor)
     
+    # Indici creati solo a dati caricati
+    crea_indici(cursor)
+    
     # Mostra statistiche
     mostra_statistiche(cursor)
     
-    # Chiudi connessione
-    conn.close()
+    # Salva su file e chiudi connessione
+    try:
+        salva_database(conn)
+    except RuntimeError as e:
+        raise SystemExit(f"✗ {e}")
+    finally:
+        conn.close()
     print("✓ Database creato e popolato con successo!")
-    print(f"✓ File database: calendario_prenotazioni.db\n")
+    print(f"✓ File database: {DB_PATH}\n")
 
 if __name__ == "__main__":
     main()
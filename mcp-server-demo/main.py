@@ -4,8 +4,14 @@ Sistema di gestione task con priorità, scadenze e difficoltà
 """
 
 from mcp.server.fastmcp import FastMCP
+import atexit
+import functools
+import os
 import sqlite3
-from datetime import datetime, timedelta
+import sys
+import threading
+import time
+from datetime import date, datetime, timedelta
 from typing import Optional
 
 # Crea il server MCP
@@ -15,13 +21,514 @@ mcp = FastMCP("TaskManager", json_response=True)
 DB_PATH = "calendario_prenotazioni.db"
 
 
+# ============= SQL =============
+# Testi delle query costanti: la cache degli statement di sqlite3 li
+# riconosce e li prepara una sola volta per connessione
+
+_SQL_INSERT_TASK = '''
+    INSERT INTO appuntamenti 
+    (titolo, descrizione, data_appuntamento, ora_inizio, ora_fine,
+     id_categoria, priorita, difficolta, tempo_stimato_ore, urgente, note, stato)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'da_fare')
+'''
+
+# Restituisce la riga scritta insieme al nome della categoria, come
+# _SQL_GET_TASK_WITH_JOIN, senza una SELECT successiva
+_RETURNING_TASK = '''
+    RETURNING *, (
+        SELECT c.nome_categoria FROM categorie c
+        WHERE c.id_categoria = appuntamenti.id_categoria
+    ) AS nome_categoria
+'''
+
+_SQL_INSERT_TASK_RETURNING = _SQL_INSERT_TASK + _RETURNING_TASK
+
+_SQL_INSERT_STORICO = '''
+    INSERT INTO storico_modifiche (id_appuntamento, tipo_modifica, descrizione_modifica)
+    VALUES (?, ?, ?)
+'''
+
+_SQL_ULTIMI_TASK = '''
+    SELECT id_appuntamento FROM appuntamenti
+    ORDER BY id_appuntamento DESC LIMIT ?
+'''
+
+_SQL_GET_TASK_WITH_JOIN = '''
+    SELECT a.*, c.nome_categoria
+    FROM appuntamenti a
+    LEFT JOIN categorie c ON a.id_categoria = c.id_categoria
+    WHERE a.id_appuntamento = ?
+'''
+
+_SQL_DATA_MODIFICA = 'SELECT data_modifica FROM appuntamenti WHERE id_appuntamento = ?'
+
+# Solo i campi citati da task_breakdown_prompt (niente note né date di sistema)
+_SQL_TASK_BREAKDOWN = '''
+    SELECT a.titolo, a.descrizione, a.data_appuntamento, a.priorita,
+           a.difficolta, a.tempo_stimato_ore, c.nome_categoria
+    FROM appuntamenti a
+    LEFT JOIN categorie c ON a.id_categoria = c.id_categoria
+    WHERE a.id_appuntamento = ?
+'''
+
+# Campi modificabili da update_task, con la voce di storico di ciascuno:
+# SET di _SQL_UPDATE_TASK, parametri e storico derivano tutti da qui
+_CAMPI_MODIFICA = (
+    ('titolo', lambda v: "Titolo aggiornato"),
+    ('descrizione', lambda v: "Descrizione aggiornata"),
+    ('data_appuntamento', lambda v: f"Data modificata: {v}"),
+    ('ora_inizio', lambda v: f"Orario inizio: {v}"),
+    ('ora_fine', lambda v: f"Orario fine: {v}"),
+    ('priorita', lambda v: f"Priorità: {v}"),
+    ('difficolta', lambda v: f"Difficoltà: {v}/10"),
+    ('tempo_stimato_ore', lambda v: f"Tempo stimato: {v}h"),
+    ('stato', lambda v: f"Stato: {v}"),
+    ('urgente', lambda v: f"Urgenza: {'SI' if v else 'NO'}"),
+    ('note', lambda v: "Note aggiornate"),
+)
+
+_SQL_UPDATE_TASK = '''
+    UPDATE appuntamenti SET
+''' + ''.join(
+    f"        {campo} = COALESCE(?, {campo}),\n" for campo, _ in _CAMPI_MODIFICA
+) + '''        data_completamento = CASE WHEN ? = 'completato'
+            THEN CURRENT_TIMESTAMP ELSE data_completamento END,
+        data_modifica = CURRENT_TIMESTAMP
+    WHERE id_appuntamento = ?
+''' + _RETURNING_TASK
+
+_SQL_COMPLETE_TASK = '''
+    UPDATE appuntamenti 
+    SET stato = 'completato', 
+        data_completamento = CURRENT_TIMESTAMP,
+        data_modifica = CURRENT_TIMESTAMP
+    WHERE id_appuntamento = ?
+    RETURNING *
+'''
+
+_SQL_DELETE_TASK = '''
+    UPDATE appuntamenti 
+    SET stato = 'cancellato', data_modifica = CURRENT_TIMESTAMP
+    WHERE id_appuntamento = ?
+    RETURNING *
+'''
+
+# Base di list_tasks: i filtri opzionali si aggiungono in coda con AND
+_SQL_LIST_TASKS = '''
+    SELECT a.*
+    FROM appuntamenti a
+    WHERE a.data_appuntamento >= ?
+'''
+
+# Ordina per urgenza, priorità, data
+_SQL_LIST_TASKS_ORDER = '''
+    ORDER BY 
+        a.urgente DESC,
+        a.priorita_rank,
+        a.data_appuntamento,
+        a.ora_inizio
+'''
+
+# Ricerca per sottostringa senza indice, per i termini troppo corti per
+# l'indice trigram o finché l'indice full-text non è disponibile:
+# INSTR non compila un pattern LIKE per ogni riga
+_SQL_SEARCH_TASKS = '''
+    SELECT a.*
+    FROM appuntamenti a
+    WHERE INSTR(LOWER(a.titolo), LOWER(?)) > 0
+       OR INSTR(LOWER(a.descrizione), LOWER(?)) > 0
+       OR INSTR(LOWER(a.note), LOWER(?)) > 0
+    ORDER BY a.data_appuntamento DESC
+'''
+
+# Ricerca sull'indice full-text: il tokenizer trigram trova le stesse
+# sottostringhe di INSTR/LIKE '%...%' purché il termine abbia almeno 3 caratteri
+_SQL_SEARCH_TASKS_FTS = '''
+    SELECT a.*
+    FROM appuntamenti_fts f
+    JOIN appuntamenti a ON a.id_appuntamento = f.rowid
+    WHERE appuntamenti_fts MATCH ?
+    ORDER BY a.data_appuntamento DESC
+'''
+
+# Indice full-text su titolo, descrizione e note, tenuto allineato da trigger
+_SQL_SCHEMA_FTS = '''
+    BEGIN IMMEDIATE;
+    CREATE VIRTUAL TABLE IF NOT EXISTS appuntamenti_fts USING fts5(
+        titolo, descrizione, note,
+        content='appuntamenti', content_rowid='id_appuntamento',
+        tokenize='trigram'
+    );
+    CREATE TRIGGER IF NOT EXISTS trg_fts_insert AFTER INSERT ON appuntamenti BEGIN
+        INSERT INTO appuntamenti_fts(rowid, titolo, descrizione, note)
+        VALUES (new.id_appuntamento, new.titolo, new.descrizione, new.note);
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_fts_delete AFTER DELETE ON appuntamenti BEGIN
+        INSERT INTO appuntamenti_fts(appuntamenti_fts, rowid, titolo, descrizione, note)
+        VALUES ('delete', old.id_appuntamento, old.titolo, old.descrizione, old.note);
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_fts_update
+    AFTER UPDATE OF titolo, descrizione, note ON appuntamenti
+    WHEN old.titolo IS NOT new.titolo
+      OR old.descrizione IS NOT new.descrizione
+      OR old.note IS NOT new.note
+    BEGIN
+        INSERT INTO appuntamenti_fts(appuntamenti_fts, rowid, titolo, descrizione, note)
+        VALUES ('delete', old.id_appuntamento, old.titolo, old.descrizione, old.note);
+        INSERT INTO appuntamenti_fts(rowid, titolo, descrizione, note)
+        VALUES (new.id_appuntamento, new.titolo, new.descrizione, new.note);
+    END;
+    COMMIT;
+'''
+
+# Ogni nuovo task riceve la voce 'creazione' nello storico dentro lo stesso
+# INSERT, senza un secondo statement da Python (lo crea anche il seed)
+_SQL_TRIGGER_STORICO = '''
+    CREATE TRIGGER IF NOT EXISTS trg_storico_creazione AFTER INSERT ON appuntamenti BEGIN
+        INSERT INTO storico_modifiche (id_appuntamento, tipo_modifica, descrizione_modifica)
+        VALUES (new.id_appuntamento, 'creazione', 'Task creato');
+    END;
+'''
+
+# Rango numerico della priorità (1 = critica) per gli ORDER BY, come nello
+# schema di calendario_prenotazioni.py; i database creati prima lo ricevono
+# come colonna VIRTUAL, l'unica forma ammessa da ALTER TABLE
+_SQL_ADD_PRIORITA_RANK = '''
+    ALTER TABLE appuntamenti ADD COLUMN priorita_rank INTEGER
+    GENERATED ALWAYS AS (
+        CASE priorita
+            WHEN 'critica' THEN 1
+            WHEN 'alta' THEN 2
+            WHEN 'media' THEN 3
+            WHEN 'bassa' THEN 4
+        END
+    ) VIRTUAL
+'''
+
+# Indice parziale con filtro e ordinamento di _FROM_TASKS_DEL_GIORNO:
+# la lista del giorno esce già ordinata, senza un passo di sort
+_SQL_INDICI = '''
+    CREATE INDEX IF NOT EXISTS idx_app_giorno_rank ON appuntamenti(
+        data_appuntamento,
+        urgente DESC,
+        priorita_rank,
+        ora_inizio
+    )
+    WHERE stato NOT IN ('completato', 'cancellato');
+    CREATE INDEX IF NOT EXISTS idx_appuntamenti_data ON appuntamenti(data_appuntamento);
+    -- Filtri di list_tasks per stato (con intervallo di date) e per categoria;
+    -- idx_app_stato_data rende superfluo l'indice del seed sul solo stato
+    CREATE INDEX IF NOT EXISTS idx_app_stato_data ON appuntamenti(stato, data_appuntamento);
+    DROP INDEX IF EXISTS idx_appuntamenti_stato;
+    CREATE INDEX IF NOT EXISTS idx_app_categoria ON appuntamenti(id_categoria, data_appuntamento);
+    PRAGMA analysis_limit=400;
+    ANALYZE;
+'''
+
+# Task ancora aperti di una data, per urgenza, priorità e orario
+_FROM_TASKS_DEL_GIORNO = '''
+    FROM appuntamenti a
+    LEFT JOIN categorie c ON a.id_categoria = c.id_categoria
+    WHERE a.data_appuntamento = ?
+    AND a.stato NOT IN ('completato', 'cancellato')
+    ORDER BY 
+        a.urgente DESC,
+        a.priorita_rank,
+        a.ora_inizio
+'''
+
+# Senza colonne di categorie SQLite elimina la LEFT JOIN dal piano
+_SQL_TASKS_DEL_GIORNO = '''
+    SELECT a.*
+''' + _FROM_TASKS_DEL_GIORNO
+
+# Solo le colonne usate dalla risorsa e dal prompt che formattano testo
+_SQL_TASKS_DEL_GIORNO_TESTO = '''
+    SELECT a.titolo, a.descrizione, a.ora_inizio, a.ora_fine, a.priorita,
+           a.difficolta, a.tempo_stimato_ore, a.urgente, c.nome_categoria
+''' + _FROM_TASKS_DEL_GIORNO
+
+_SQL_STATISTICHE_GIORNO = '''
+    SELECT
+        COALESCE(SUM(urgente = 1), 0) AS urgenti,
+        COALESCE(SUM(priorita = 'critica'), 0) AS priorita_critica,
+        COALESCE(SUM(priorita = 'alta'), 0) AS priorita_alta
+    FROM appuntamenti
+    WHERE data_appuntamento = ?
+    AND stato NOT IN ('completato', 'cancellato')
+'''
+
+# Panoramica del prompt di pianificazione, aggregata da SQLite
+_SQL_PANORAMICA_GIORNO = '''
+    SELECT
+        COUNT(*) AS totale,
+        COALESCE(SUM(urgente), 0) AS urgenti,
+        COALESCE(SUM(priorita = 'critica'), 0) AS critici,
+        COALESCE(SUM(tempo_stimato_ore), 0) AS tempo_totale
+    FROM appuntamenti
+    WHERE data_appuntamento = ?
+    AND stato NOT IN ('completato', 'cancellato')
+'''
+
+_SQL_GET_CATEGORIES = 'SELECT * FROM categorie ORDER BY nome_categoria'
+
+_SQL_CATEGORIE_LOOKUP = 'SELECT id_categoria, nome_categoria, colore FROM categorie'
+
+
+def _prepara_rank(conn):
+    """journal_mode=WAL e colonna priorita_rank per i database creati prima"""
+    conn.execute("PRAGMA journal_mode=WAL")
+    
+    # table_xinfo elenca anche le colonne generate, table_info no
+    colonne = {row[1] for row in conn.execute("PRAGMA table_xinfo(appuntamenti)")}
+    if 'priorita_rank' not in colonne:
+        conn.execute(_SQL_ADD_PRIORITA_RANK)
+
+
+def _prepara_fts(conn):
+    """Crea l'indice full-text e lo popola con i task esistenti"""
+    fts_presente = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'appuntamenti_fts'"
+    ).fetchone()
+    conn.executescript(_SQL_SCHEMA_FTS)
+    if not fts_presente:
+        conn.execute("INSERT INTO appuntamenti_fts(appuntamenti_fts) VALUES ('rebuild')")
+        conn.commit()
+
+
+# Passi di _init_db, ognuno indipendente dagli altri: se l'indice full-text
+# non si può creare il trigger dello storico viene installato comunque
+_PASSI_INIT = (
+    ('priorita_rank', _prepara_rank),
+    ('storico', lambda conn: conn.executescript(_SQL_TRIGGER_STORICO)),
+    ('indice full-text', _prepara_fts),
+    ('indici', lambda conn: conn.executescript(_SQL_INDICI)),
+)
+
+# Inode del file di database già preparato da _init_db (None: nessuno) e se
+# il suo indice full-text è utilizzabile; senza, search_tasks usa
+# _SQL_SEARCH_TASKS. Un nuovo seed sostituisce il file e cambia l'inode
+_db_pronto = None
+_fts_pronto = False
+_init_lock = threading.Lock()
+
+
+def _inode_db():
+    """Inode del file DB_PATH, None se il file non esiste"""
+    try:
+        return os.stat(DB_PATH).st_ino
+    except FileNotFoundError:
+        return None
+
+
+def _init_db(inode):
+    """Prepara il file di database (identificato dall'inode) alla prima connessione
+    
+    journal_mode=WAL è persistente nel file: basta impostarlo una volta,
+    le altre PRAGMA valgono per connessione e stanno in get_db_connection.
+    Aggiunge priorita_rank se manca, il trigger dello storico, l'indice
+    full-text, gli indici usati dai tool e aggiorna le statistiche del planner.
+    
+    Finché il database non esiste o non è popolato non fa nulla e riprova alla
+    connessione successiva: i tool restituiscono l'errore come sempre. Un
+    passo fallito viene segnalato su stderr (stdout è del protocollo MCP);
+    senza il trigger dello storico il database non risulta pronto.
+    """
+    global _db_pronto, _fts_pronto
+    with _init_lock:
+        # Senza file sqlite3.connect ne creerebbe uno vuoto
+        if inode is None or _db_pronto == inode:
+            return
+        
+        _fts_pronto = False
+        conn = sqlite3.connect(DB_PATH)
+        try:
+            tabella = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'appuntamenti'"
+            ).fetchone()
+            if not tabella:
+                return
+            
+            falliti = []
+            for nome, passo in _PASSI_INIT:
+                try:
+                    passo(conn)
+                except sqlite3.Error as e:
+                    if conn.in_transaction:
+                        conn.rollback()
+                    falliti.append(nome)
+                    print(f"Preparazione del database ({nome}) non riuscita: {e}",
+                          file=sys.stderr)
+            if 'storico' not in falliti:
+                _db_pronto = inode
+            _fts_pronto = 'indice full-text' not in falliti
+        finally:
+            conn.close()
+
+
+# Connessioni riusate tra le chiamate: una per thread
+_local = threading.local()
+_connections = []
+_connections_lock = threading.Lock()
+
+
 def get_db_connection():
-    """Crea una connessione al database"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+    """Restituisce la connessione al database del thread corrente
+    
+    La connessione viene aperta alla prima chiamata e poi riusata, così la
+    cache delle pagine di SQLite sopravvive tra un tool e l'altro. Finché il
+    database non è pronto ogni chiamata riprova a prepararlo.
+    
+    Se DB_PATH è stato sostituito (calendario_prenotazioni.py scrive un file
+    nuovo) la connessione punta ancora al vecchio: viene chiusa e riaperta.
+    """
+    inode = _inode_db()
+    if _db_pronto != inode:
+        _init_db(inode)
+    
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.inode != inode:
+        with _connections_lock:
+            _connections.remove(conn)
+        conn.close()
+        conn = None
+        # Le cache globali descrivono il vecchio file
+        _categorie.cache_clear()
+        _render_task.cache_clear()
+    
+    if conn is None:
+        # isolation_level=None: niente BEGIN impliciti, le letture restano in
+        # autocommit e i tool di scrittura aprono la transazione da soli
+        conn = sqlite3.connect(DB_PATH, check_same_thread=False, cached_statements=256,
+                               isolation_level=None)
+        # Righe come tuple: i tool le convertono con _righe_dict/_riga_dict,
+        # solo le risorse e i prompt che leggono per nome usano sqlite3.Row
+        conn.text_factory = str
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-131072")
+        conn.execute("PRAGMA mmap_size=268435456")
+        conn.execute("PRAGMA wal_autocheckpoint=1000")
+        _local.conn = conn
+        # connect crea il file se manca: l'inode si legge dopo
+        _local.inode = _inode_db()
+        _local.cache_oggi = {}
+        with _connections_lock:
+            _connections.append(conn)
     return conn
 
 
+@atexit.register
+def close_db_connections():
+    """Chiude tutte le connessioni aperte all'uscita del processo"""
+    with _connections_lock:
+        for conn in _connections:
+            conn.close()
+        _connections.clear()
+
+
+# (scadenza, data): la data di oggi in ISO, valida fino alla prossima mezzanotte
+_oggi_scadenza = (0.0, '')
+
+
+def _oggi():
+    """Data di oggi in formato YYYY-MM-DD, ricalcolata solo al cambio di giorno"""
+    global _oggi_scadenza
+    scadenza, oggi = _oggi_scadenza
+    if time.time() < scadenza:
+        return oggi
+    
+    giorno = date.today()
+    mezzanotte = datetime.combine(giorno + timedelta(days=1), datetime.min.time())
+    oggi = giorno.isoformat()
+    _oggi_scadenza = (mezzanotte.timestamp(), oggi)
+    return oggi
+
+
+def _da_cache_oggi(tipo, calcola):
+    """Restituisce calcola(oggi), riusando il risultato finché i dati non cambiano
+    
+    La cache sta in _local.cache_oggi, per tipo: (data, data_version, valore).
+    È per connessione perché lo è PRAGMA data_version: cambia quando scrive
+    un'altra connessione (altri thread o processi), non per le scritture
+    della connessione stessa, dopo le quali _invalida_cache la svuota.
+    """
+    oggi = _oggi()
+    versione = get_db_connection().execute("PRAGMA data_version").fetchone()[0]
+    cache = _local.cache_oggi
+    voce = cache.get(tipo)
+    if voce is not None and voce[0] == oggi and voce[1] == versione:
+        return voce[2]
+    
+    valore = calcola(oggi)
+    cache[tipo] = (oggi, versione, valore)
+    return valore
+
+
+def _invalida_cache():
+    """Da chiamare dopo ogni scrittura sui task, dal thread che l'ha fatta"""
+    _local.cache_oggi.clear()
+    # data_modifica ha la risoluzione del secondo: due modifiche nello
+    # stesso secondo lascerebbero in cache il testo vecchio
+    _render_task.cache_clear()
+
+
+# Chiave di ordinamento interna (colonna generata): resta fuori dai task
+# restituiti anche quando la query usa SELECT a.* o RETURNING *
+_COLONNA_INTERNA = 'priorita_rank'
+
+
+def _righe_dict(cursor):
+    """Converte il risultato di una query in una lista di dict
+    
+    I nomi delle colonne si leggono una volta da cursor.description:
+    zip su ogni riga costa meno di dict(sqlite3.Row).
+    """
+    colonne = [d[0] for d in cursor.description]
+    righe = [dict(zip(colonne, row)) for row in cursor.fetchall()]
+    if _COLONNA_INTERNA in colonne:
+        for riga in righe:
+            del riga[_COLONNA_INTERNA]
+    return righe
+
+
+def _riga_dict(cursor):
+    """Come _righe_dict per una sola riga; None se la query non ne restituisce"""
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    riga = dict(zip([d[0] for d in cursor.description], row))
+    riga.pop(_COLONNA_INTERNA, None)
+    return riga
+
+
+@functools.lru_cache(maxsize=1)
+def _categorie():
+    """Nome e colore di ogni categoria, per id_categoria
+    
+    Le categorie sono poche e cambiano di rado: le liste di task le leggono
+    da qui invece di fare la JOIN con categorie in ogni query.
+    """
+    rows = get_db_connection().execute(_SQL_CATEGORIE_LOOKUP).fetchall()
+    return {id_categoria: (nome, colore) for id_categoria, nome, colore in rows}
+
+
+def _aggiungi_categoria(tasks, colore=False):
+    """Aggiunge nome_categoria (e colore, se richiesto) a ogni task"""
+    categorie = _categorie()
+    for task in tasks:
+        nome_cat, colore_cat = categorie.get(task['id_categoria'], (None, None))
+        task['nome_categoria'] = nome_cat
+        if colore:
+            task['colore'] = colore_cat
+    return tasks
+
+
+def _log_storico(conn, righe):
+    """Registra nello storico una lista di (id_appuntamento, tipo, descrizione)"""
+    conn.executemany(_SQL_INSERT_STORICO, righe)
+
+
 # ============= TOOLS: GESTIONE TASK =============
 
 @mcp.tool()
@@ -58,44 +565,71 @@ def create_task(
     """
     try:
         conn = get_db_connection()
-        cursor = conn.cursor()
         
-        # Inserisci task
-        cursor.execute('''
-            INSERT INTO appuntamenti 
-            (titolo, descrizione, data_appuntamento, ora_inizio, ora_fine,
-             id_categoria, priorita, difficolta, tempo_stimato_ore, urgente, note, stato)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'da_fare')
-        ''', (titolo, descrizione, data_appuntamento, ora_inizio, ora_fine,
-              id_categoria, priorita, difficolta, tempo_stimato_ore, 
-              1 if urgente else 0, note))
+        # Inserimento, storico e lettura del task creato in un'unica
+        # transazione; RETURNING evita la SELECT successiva
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            cursor = conn.execute(_SQL_INSERT_TASK_RETURNING, (
+                titolo, descrizione, data_appuntamento, ora_inizio, ora_fine,
+                id_categoria, priorita, difficolta, tempo_stimato_ore,
+                1 if urgente else 0, note
+            ))
+            # La voce 'creazione' dello storico la scrive trg_storico_creazione
+            task = _riga_dict(cursor)
         
-        task_id = cursor.lastrowid
+        _invalida_cache()
         
-        # Registra nello storico
-        cursor.execute('''
-            INSERT INTO storico_modifiche (id_appuntamento, tipo_modifica, descrizione_modifica)
-            VALUES (?, 'creazione', 'Task creato')
-        ''', (task_id,))
+        return {
+            "success": True,
+            "message": f"Task '{titolo}' creato con successo",
+            "task": task
+        }
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+
+@mcp.tool()
+def create_tasks_bulk(tasks: list[dict]) -> dict:
+    """Crea più task in un'unica transazione
+    
+    Args:
+        tasks: Lista di task, ognuno con gli stessi campi di create_task
+               (titolo e data_appuntamento richiesti)
+    
+    Returns:
+        ID dei task creati
+    """
+    if not tasks:
+        return {"success": False, "error": "Nessun task specificato"}
+    
+    try:
+        righe = [(
+            t['titolo'], t.get('descrizione'), t['data_appuntamento'],
+            t.get('ora_inizio'), t.get('ora_fine'), t.get('id_categoria'),
+            t.get('priorita', 'media'), t.get('difficolta', 5),
+            t.get('tempo_stimato_ore'), 1 if t.get('urgente') else 0, t.get('note')
+        ) for t in tasks]
         
-        conn.commit()
+        conn = get_db_connection()
         
-        # Recupera task creato
-        cursor.execute('''
-            SELECT a.*, c.nome_categoria
-            FROM appuntamenti a
-            LEFT JOIN categorie c ON a.id_categoria = c.id_categoria
-            WHERE a.id_appuntamento = ?
-        ''', (task_id,))
+        # Il lock di scrittura preso subito garantisce che gli ultimi
+        # ID letti dopo l'inserimento siano proprio quelli appena creati;
+        # lo storico lo scrive trg_storico_creazione
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(_SQL_INSERT_TASK, righe)
+            ids = [r[0] for r in conn.execute(_SQL_ULTIMI_TASK, (len(righe),))][::-1]
         
-        task = dict(cursor.fetchone())
-        conn.close()
+        _invalida_cache()
         
         return {
             "success": True,
-            "message": f"Task '{titolo}' creato con successo",
-            "task": task
+            "message": f"{len(ids)} task creati con successo",
+            "ids": ids
         }
+    except KeyError as e:
+        return {"success": False, "error": f"Campo richiesto mancante: {e.args[0]}"}
     except Exception as e:
         return {"success": False, "error": str(e)}
 
@@ -124,21 +658,12 @@ def list_tasks(
     """
     try:
         conn = get_db_connection()
-        cursor = conn.cursor()
         
-        sql = '''
-            SELECT a.*, c.nome_categoria, c.colore
-            FROM appuntamenti a
-            LEFT JOIN categorie c ON a.id_categoria = c.id_categoria
-            WHERE 1=1
-        '''
-        params = []
-        
-        if data_da:
-            sql += ' AND a.data_appuntamento >= ?'
-            params.append(data_da)
-        else:
-            sql += ' AND a.data_appuntamento >= DATE("now")'
+        # Un testo SQL per combinazione di filtri: sono al massimo 32 e
+        # restano tutti nella cache degli statement della connessione.
+        # Senza data_da si parte da oggi, passato come parametro
+        sql = _SQL_LIST_TASKS
+        params = [data_da or _oggi()]
         
         if data_a:
             sql += ' AND a.data_appuntamento <= ?'
@@ -160,23 +685,8 @@ def list_tasks(
             sql += ' AND a.id_categoria = ?'
             params.append(categoria)
         
-        # Ordina per urgenza, priorità, data
-        sql += '''
-            ORDER BY 
-                a.urgente DESC,
-                CASE a.priorita
-                    WHEN 'critica' THEN 1
-                    WHEN 'alta' THEN 2
-                    WHEN 'media' THEN 3
-                    WHEN 'bassa' THEN 4
-                END,
-                a.data_appuntamento,
-                a.ora_inizio
-        '''
-        
-        cursor.execute(sql, params)
-        tasks = [dict(row) for row in cursor.fetchall()]
-        conn.close()
+        cursor = conn.execute(sql + _SQL_LIST_TASKS_ORDER, params)
+        tasks = _aggiungi_categoria(_righe_dict(cursor), colore=True)
         
         return {
             "success": True,
@@ -223,106 +733,46 @@ def update_task(
     """
     try:
         conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Verifica esistenza
-        cursor.execute('SELECT * FROM appuntamenti WHERE id_appuntamento = ?', (id_task,))
-        if not cursor.fetchone():
-            conn.close()
-            return {"success": False, "error": "Task non trovato"}
-        
-        modifiche = []
-        updates = []
-        params = []
-        
-        if titolo is not None:
-            updates.append('titolo = ?')
-            params.append(titolo)
-            modifiche.append(f"Titolo aggiornato")
-        
-        if descrizione is not None:
-            updates.append('descrizione = ?')
-            params.append(descrizione)
-            modifiche.append("Descrizione aggiornata")
-        
-        if data_appuntamento is not None:
-            updates.append('data_appuntamento = ?')
-            params.append(data_appuntamento)
-            modifiche.append(f"Data modificata: {data_appuntamento}")
-        
-        if ora_inizio is not None:
-            updates.append('ora_inizio = ?')
-            params.append(ora_inizio)
-            modifiche.append(f"Orario inizio: {ora_inizio}")
-        
-        if ora_fine is not None:
-            updates.append('ora_fine = ?')
-            params.append(ora_fine)
-            modifiche.append(f"Orario fine: {ora_fine}")
-        
-        if priorita is not None:
-            updates.append('priorita = ?')
-            params.append(priorita)
-            modifiche.append(f"Priorità: {priorita}")
-        
-        if difficolta is not None:
-            updates.append('difficolta = ?')
-            params.append(difficolta)
-            modifiche.append(f"Difficoltà: {difficolta}/10")
         
-        if tempo_stimato_ore is not None:
-            updates.append('tempo_stimato_ore = ?')
-            params.append(tempo_stimato_ore)
-            modifiche.append(f"Tempo stimato: {tempo_stimato_ore}h")
-        
-        if stato is not None:
-            updates.append('stato = ?')
-            params.append(stato)
-            modifiche.append(f"Stato: {stato}")
-            
-            # Se completato, aggiungi timestamp
-            if stato == 'completato':
-                updates.append('data_completamento = CURRENT_TIMESTAMP')
-        
-        if urgente is not None:
-            updates.append('urgente = ?')
-            params.append(1 if urgente else 0)
-            modifiche.append(f"Urgenza: {'SI' if urgente else 'NO'}")
+        # Nuovi valori per nome di campo (None = invariato)
+        nuovi = {
+            'titolo': titolo,
+            'descrizione': descrizione,
+            'data_appuntamento': data_appuntamento,
+            'ora_inizio': ora_inizio,
+            'ora_fine': ora_fine,
+            'priorita': priorita,
+            'difficolta': difficolta,
+            'tempo_stimato_ore': tempo_stimato_ore,
+            'stato': stato,
+            'urgente': None if urgente is None else (1 if urgente else 0),
+            'note': note,
+        }
+        valori = [nuovi[campo] for campo, _ in _CAMPI_MODIFICA]
         
-        if note is not None:
-            updates.append('note = ?')
-            params.append(note)
+        # Descrizione delle modifiche per lo storico e per la risposta
+        modifiche = [
+            etichetta(nuovi[campo])
+            for campo, etichetta in _CAMPI_MODIFICA
+            if nuovi[campo] is not None
+        ]
         
-        if not updates:
-            conn.close()
+        if not modifiche:
             return {"success": False, "error": "Nessuna modifica specificata"}
         
-        # Aggiorna timestamp modifica
-        updates.append('data_modifica = CURRENT_TIMESTAMP')
-        
-        # Esegui update
-        params.append(id_task)
-        sql = f"UPDATE appuntamenti SET {', '.join(updates)} WHERE id_appuntamento = ?"
-        cursor.execute(sql, params)
-        
-        # Registra nello storico
-        cursor.execute('''
-            INSERT INTO storico_modifiche (id_appuntamento, tipo_modifica, descrizione_modifica)
-            VALUES (?, 'modifica', ?)
-        ''', (id_task, '; '.join(modifiche)))
-        
-        conn.commit()
-        
-        # Recupera task aggiornato
-        cursor.execute('''
-            SELECT a.*, c.nome_categoria
-            FROM appuntamenti a
-            LEFT JOIN categorie c ON a.id_categoria = c.id_categoria
-            WHERE a.id_appuntamento = ?
-        ''', (id_task,))
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            # Testo SQL fisso: i campi a None restano invariati grazie a COALESCE
+            cursor = conn.execute(_SQL_UPDATE_TASK, (*valori, stato, id_task))
+            task = _riga_dict(cursor)
+            
+            if task is None:
+                return {"success": False, "error": "Task non trovato"}
+            
+            # Registra nello storico una riga per ogni modifica
+            _log_storico(conn, [(id_task, 'modifica', m) for m in modifiche])
         
-        task = dict(cursor.fetchone())
-        conn.close()
+        _invalida_cache()
         
         return {
             "success": True,
@@ -346,30 +796,18 @@ def complete_task(id_task: int) -> dict:
     """
     try:
         conn = get_db_connection()
-        cursor = conn.cursor()
         
-        cursor.execute('''
-            UPDATE appuntamenti 
-            SET stato = 'completato', 
-                data_completamento = CURRENT_TIMESTAMP,
-                data_modifica = CURRENT_TIMESTAMP
-            WHERE id_appuntamento = ?
-        ''', (id_task,))
-        
-        if cursor.rowcount == 0:
-            conn.close()
-            return {"success": False, "error": "Task non trovato"}
-        
-        cursor.execute('''
-            INSERT INTO storico_modifiche (id_appuntamento, tipo_modifica, descrizione_modifica)
-            VALUES (?, 'completamento', 'Task completato')
-        ''', (id_task,))
-        
-        conn.commit()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            cursor = conn.execute(_SQL_COMPLETE_TASK, (id_task,))
+            task = _riga_dict(cursor)
+            
+            if task is None:
+                return {"success": False, "error": "Task non trovato"}
+            
+            _log_storico(conn, [(id_task, 'completamento', 'Task completato')])
         
-        cursor.execute('SELECT * FROM appuntamenti WHERE id_appuntamento = ?', (id_task,))
-        task = dict(cursor.fetchone())
-        conn.close()
+        _invalida_cache()
         
         return {
             "success": True,
@@ -393,31 +831,19 @@ def delete_task(id_task: int, motivo: str = None) -> dict:
     """
     try:
         conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT * FROM appuntamenti WHERE id_appuntamento = ?', (id_task,))
-        task = cursor.fetchone()
-        
-        if not task:
-            conn.close()
-            return {"success": False, "error": "Task non trovato"}
-        
-        task = dict(task)
-        
-        cursor.execute('''
-            UPDATE appuntamenti 
-            SET stato = 'cancellato', data_modifica = CURRENT_TIMESTAMP
-            WHERE id_appuntamento = ?
-        ''', (id_task,))
         
-        descrizione = f"Task cancellato. Motivo: {motivo}" if motivo else "Task cancellato"
-        cursor.execute('''
-            INSERT INTO storico_modifiche (id_appuntamento, tipo_modifica, descrizione_modifica)
-            VALUES (?, 'cancellazione', ?)
-        ''', (id_task, descrizione))
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            cursor = conn.execute(_SQL_DELETE_TASK, (id_task,))
+            task = _riga_dict(cursor)
+            
+            if task is None:
+                return {"success": False, "error": "Task non trovato"}
+            
+            descrizione = f"Task cancellato. Motivo: {motivo}" if motivo else "Task cancellato"
+            _log_storico(conn, [(id_task, 'cancellazione', descrizione)])
         
-        conn.commit()
-        conn.close()
+        _invalida_cache()
         
         return {
             "success": True,
@@ -440,21 +866,15 @@ def search_tasks(query: str) -> dict:
     """
     try:
         conn = get_db_connection()
-        cursor = conn.cursor()
         
-        pattern = f'%{query}%'
-        cursor.execute('''
-            SELECT a.*, c.nome_categoria
-            FROM appuntamenti a
-            LEFT JOIN categorie c ON a.id_categoria = c.id_categoria
-            WHERE a.titolo LIKE ? 
-               OR a.descrizione LIKE ?
-               OR a.note LIKE ?
-            ORDER BY a.data_appuntamento DESC
-        ''', (pattern, pattern, pattern))
-        
-        risultati = [dict(row) for row in cursor.fetchall()]
-        conn.close()
+        if len(query) >= 3 and _fts_pronto:
+            # Il termine è una frase FTS5: le virgolette interne vanno raddoppiate
+            frase = '"' + query.replace('"', '""') + '"'
+            cursor = conn.execute(_SQL_SEARCH_TASKS_FTS, (frase,))
+        else:
+            cursor = conn.execute(_SQL_SEARCH_TASKS, (query, query, query))
+        
+        risultati = _aggiungi_categoria(_righe_dict(cursor))
         
         return {
             "success": True,
@@ -474,51 +894,30 @@ def get_today_tasks() -> dict:
         Task di oggi ordinati per priorità e orario
     """
     try:
-        oggi = datetime.now().strftime('%Y-%m-%d')
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT a.*, c.nome_categoria, c.colore
-            FROM appuntamenti a
-            LEFT JOIN categorie c ON a.id_categoria = c.id_categoria
-            WHERE a.data_appuntamento = ?
-            AND a.stato NOT IN ('completato', 'cancellato')
-            ORDER BY 
-                a.urgente DESC,
-                CASE a.priorita
-                    WHEN 'critica' THEN 1
-                    WHEN 'alta' THEN 2
-                    WHEN 'media' THEN 3
-                    WHEN 'bassa' THEN 4
-                END,
-                a.ora_inizio
-        ''', (oggi,))
-        
-        tasks = [dict(row) for row in cursor.fetchall()]
-        
-        # Statistiche
-        urgenti = sum(1 for t in tasks if t['urgente'])
-        critica = sum(1 for t in tasks if t['priorita'] == 'critica')
-        alta = sum(1 for t in tasks if t['priorita'] == 'alta')
-        
-        conn.close()
-        
-        return {
-            "success": True,
-            "data": oggi,
-            "totale_tasks": len(tasks),
-            "statistiche": {
-                "urgenti": urgenti,
-                "priorita_critica": critica,
-                "priorita_alta": alta
-            },
-            "tasks": tasks
-        }
+        return _da_cache_oggi('tasks', _calcola_today_tasks)
     except Exception as e:
         return {"success": False, "error": str(e)}
 
 
+def _calcola_today_tasks(oggi):
+    """Corpo di get_today_tasks, senza cache"""
+    conn = get_db_connection()
+    cursor = conn.execute(_SQL_TASKS_DEL_GIORNO, (oggi,))
+    
+    tasks = _aggiungi_categoria(_righe_dict(cursor), colore=True)
+    
+    # Statistiche calcolate da SQLite in un solo passaggio
+    statistiche = _riga_dict(conn.execute(_SQL_STATISTICHE_GIORNO, (oggi,)))
+    
+    return {
+        "success": True,
+        "data": oggi,
+        "totale_tasks": len(tasks),
+        "statistiche": statistiche,
+        "tasks": tasks
+    }
+
+
 @mcp.tool()
 def get_categories() -> dict:
     """Ottieni tutte le categorie disponibili
@@ -528,11 +927,10 @@ def get_categories() -> dict:
     """
     try:
         conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT * FROM categorie ORDER BY nome_categoria')
-        categorie = [dict(row) for row in cursor.fetchall()]
-        conn.close()
+        # Rilegge le categorie: anche la cache usata dalle liste va aggiornata
+        _categorie.cache_clear()
+        cursor = conn.execute(_SQL_GET_CATEGORIES)
+        categorie = _righe_dict(cursor)
         
         return {
             "success": True,
@@ -545,6 +943,33 @@ def get_categories() -> dict:
 
 # ============= RESOURCES =============
 
+# Emoji per stato e priorità, condivise dalle risorse
+_STATO_EMOJI = {
+    'da_fare': '⏳',
+    'in_corso': '🔄',
+    'completato': '✅',
+    'cancellato': '❌',
+    'posticipato': '📅'
+}
+
+_PRIORITA_EMOJI = {
+    'critica': '🔴',
+    'alta': '🟠',
+    'media': '🟡',
+    'bassa': '🟢'
+}
+
+# Stelle per ogni livello di difficoltà (1-10, vincolo CHECK dello schema)
+_STELLE = tuple('⭐' * i for i in range(11))
+
+
+def _anteprima(testo):
+    """Primi 60 caratteri di una descrizione, con '...' se è più lunga"""
+    if not testo:
+        return ''
+    return testo[:60] + '...' if len(testo) > 60 else testo
+
+
 @mcp.resource("task://{id_task}")
 def get_task_resource(id_task: str) -> str:
     """Risorsa per visualizzare i dettagli formattati di un task
@@ -556,49 +981,41 @@ def get_task_resource(id_task: str) -> str:
         Dettagli formattati del task
     """
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT a.*, c.nome_categoria
-            FROM appuntamenti a
-            LEFT JOIN categorie c ON a.id_categoria = c.id_categoria
-            WHERE a.id_appuntamento = ?
-        ''', (id_task,))
-        
-        task = cursor.fetchone()
+        # Lettura dal solo indice della chiave primaria: il testo completo
+        # si ricostruisce solo se il task è cambiato dall'ultima volta
+        row = get_db_connection().execute(_SQL_DATA_MODIFICA, (id_task,)).fetchone()
         
-        if not task:
-            conn.close()
+        if not row:
             return f"❌ Task {id_task} non trovato"
         
-        task = dict(task)
+        return _render_task(id_task, row[0])
         
-        # Emoji per stato
-        stato_emoji = {
-            'da_fare': '⏳',
-            'in_corso': '🔄',
-            'completato': '✅',
-            'cancellato': '❌',
-            'posticipato': '📅'
-        }
-        
-        # Emoji per priorità
-        priorita_emoji = {
-            'critica': '🔴',
-            'alta': '🟠',
-            'media': '🟡',
-            'bassa': '🟢'
-        }
-        
-        urgente_flag = " 🚨 URGENTE" if task['urgente'] else ""
-        orario = f"   Orario: {task['ora_inizio']}"
-        if task['ora_fine']:
-            orario += f" - {task['ora_fine']}"
-        orario = orario if task['ora_inizio'] else ""
-        
-        result = f"""
-{stato_emoji.get(task['stato'], '📋')} TASK #{task['id_appuntamento']}{urgente_flag}
+    except Exception as e:
+        return f"❌ Errore: {str(e)}"
+
+
+@functools.lru_cache(maxsize=512)
+def _render_task(id_task, data_modifica):
+    """Corpo di get_task_resource per una versione del task"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    # Il task serve solo da formattare: basta la sqlite3.Row
+    cursor.row_factory = sqlite3.Row
+    cursor.execute(_SQL_GET_TASK_WITH_JOIN, (id_task,))
+    
+    task = cursor.fetchone()
+    
+    if not task:
+        return f"❌ Task {id_task} non trovato"
+    
+    urgente_flag = " 🚨 URGENTE" if task['urgente'] else ""
+    orario = f"   Orario: {task['ora_inizio']}"
+    if task['ora_fine']:
+        orario += f" - {task['ora_fine']}"
+    orario = orario if task['ora_inizio'] else ""
+    
+    result = f"""
+{_STATO_EMOJI.get(task['stato'], '📋')} TASK #{task['id_appuntamento']}{urgente_flag}
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 
 📋 {task['titolo']}
@@ -608,9 +1025,9 @@ def get_task_resource(id_task: str) -> str:
    Data: {task['data_appuntamento']}
 {orario}
 
-{priorita_emoji.get(task['priorita'], '⚪')} PRIORITÀ E DIFFICOLTÀ
+{_PRIORITA_EMOJI.get(task['priorita'], '⚪')} PRIORITÀ E DIFFICOLTÀ
    Priorità: {task['priorita'].upper()}
-   Difficoltà: {'⭐' * task['difficolta']} ({task['difficolta']}/10)
+   Difficoltà: {_STELLE[task['difficolta']]} ({task['difficolta']}/10)
    {f"Tempo stimato: {task['tempo_stimato_ore']} ore" if task['tempo_stimato_ore'] else ""}
 
 📂 CATEGORIA
@@ -629,13 +1046,9 @@ def get_task_resource(id_task: str) -> str:
 ⏰ INFO SISTEMA
    Creato: {task['data_creazione']}
    Modificato: {task['data_modifica']}
-        """.strip()
-        
-        conn.close()
-        return result
-        
-    except Exception as e:
-        return f"❌ Errore: {str(e)}"
+    """.strip()
+    
+    return result
 
 
 @mcp.resource("today://tasks")
@@ -646,60 +1059,47 @@ def get_today_resource() -> str:
         Task di oggi formattati
     """
     try:
-        oggi = datetime.now().strftime('%Y-%m-%d')
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT a.*, c.nome_categoria
-            FROM appuntamenti a
-            LEFT JOIN categorie c ON a.id_categoria = c.id_categoria
-            WHERE a.data_appuntamento = ?
-            AND a.stato NOT IN ('completato', 'cancellato')
-            ORDER BY 
-                a.urgente DESC,
-                CASE a.priorita
-                    WHEN 'critica' THEN 1
-                    WHEN 'alta' THEN 2
-                    WHEN 'media' THEN 3
-                    WHEN 'bassa' THEN 4
-                END,
-                a.ora_inizio
-        ''', (oggi,))
-        
-        tasks = [dict(row) for row in cursor.fetchall()]
-        conn.close()
-        
-        if not tasks:
-            return f"✅ Nessun task in programma per oggi ({oggi})"
-        
-        priorita_emoji = {'critica': '🔴', 'alta': '🟠', 'media': '🟡', 'bassa': '🟢'}
-        
-        result = f"""
+        return _da_cache_oggi('resource', _calcola_today_resource)
+    except Exception as e:
+        return f"❌ Errore: {str(e)}"
+
+
+def _calcola_today_resource(oggi):
+    """Corpo di get_today_resource, senza cache"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    # Le sqlite3.Row si leggono per nome: nessuna copia in dict
+    cursor.row_factory = sqlite3.Row
+    
+    cursor.execute(_SQL_TASKS_DEL_GIORNO_TESTO, (oggi,))
+    
+    tasks = cursor.fetchall()
+    
+    if not tasks:
+        return f"✅ Nessun task in programma per oggi ({oggi})"
+    
+    parti = [f"""
 📅 TASK DI OGGI - {oggi}
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 Totale task: {len(tasks)}
 
-"""
+"""]
+    
+    for task in tasks:
+        urgente_flag = " 🚨" if task['urgente'] else ""
+        orario = f"{task['ora_inizio']}" if task['ora_inizio'] else "📋"
+        emoji_p = _PRIORITA_EMOJI.get(task['priorita'], '⚪')
+        difficolta_stelle = _STELLE[task['difficolta']]
         
-        for task in tasks:
-            urgente_flag = " 🚨" if task['urgente'] else ""
-            orario = f"{task['ora_inizio']}" if task['ora_inizio'] else "📋"
-            emoji_p = priorita_emoji.get(task['priorita'], '⚪')
-            difficolta_stelle = '⭐' * task['difficolta']
-            
-            result += f"""
+        parti.append(f"""
 {orario} {emoji_p} {task['titolo']}{urgente_flag}
    Difficoltà: {difficolta_stelle} ({task['difficolta']}/10)
    Categoria: {task['nome_categoria'] or 'N/A'}
-   {task['descrizione'][:60] + '...' if task['descrizione'] and len(task['descrizione']) > 60 else task['descrizione'] or ''}
+   {_anteprima(task['descrizione'])}
 
-"""
-        
-        return result.strip()
-        
-    except Exception as e:
-        return f"❌ Errore: {str(e)}"
+""")
+    
+    return ''.join(parti).strip()
 
 
 # ============= PROMPTS =============
@@ -716,60 +1116,41 @@ def daily_planning_prompt(data: str = None) -> str:
     """
     try:
         if not data:
-            data = datetime.now().strftime('%Y-%m-%d')
+            data = _oggi()
         
         conn = get_db_connection()
         cursor = conn.cursor()
+        # Le sqlite3.Row si leggono per nome: nessuna copia in dict
+        cursor.row_factory = sqlite3.Row
         
-        cursor.execute('''
-            SELECT a.*, c.nome_categoria
-            FROM appuntamenti a
-            LEFT JOIN categorie c ON a.id_categoria = c.id_categoria
-            WHERE a.data_appuntamento = ?
-            AND a.stato NOT IN ('completato', 'cancellato')
-            ORDER BY 
-                a.urgente DESC,
-                CASE a.priorita
-                    WHEN 'critica' THEN 1
-                    WHEN 'alta' THEN 2
-                    WHEN 'media' THEN 3
-                    WHEN 'bassa' THEN 4
-                END,
-                a.ora_inizio
-        ''', (data,))
-        
-        tasks = [dict(row) for row in cursor.fetchall()]
-        conn.close()
-        
-        urgenti = [t for t in tasks if t['urgente']]
-        critici = [t for t in tasks if t['priorita'] == 'critica']
+        cursor.execute(_SQL_PANORAMICA_GIORNO, (data,))
+        panoramica = cursor.fetchone()
         
-        tempo_totale = sum(t['tempo_stimato_ore'] or 0 for t in tasks)
+        cursor.execute(_SQL_TASKS_DEL_GIORNO_TESTO, (data,))
         
-        prompt = f"""
-Crea un piano di lavoro ottimizzato per il {data}.
-
-📊 PANORAMICA:
-- Totale task: {len(tasks)}
-- Task urgenti: {len(urgenti)}
-- Task critici: {len(critici)}
-- Tempo totale stimato: {tempo_totale} ore
-
-📋 TASK DA COMPLETARE:
-"""
-        
-        for task in tasks:
+        righe = []
+        for task in cursor:
             urgente_flag = "🚨 URGENTE - " if task['urgente'] else ""
             orario = f"[{task['ora_inizio']}-{task['ora_fine']}] " if task['ora_inizio'] and task['ora_fine'] else ""
             tempo = f" ({task['tempo_stimato_ore']}h)" if task['tempo_stimato_ore'] else ""
             
-            prompt += f"""
+            righe.append(f"""
 - {orario}{urgente_flag}[{task['priorita'].upper()}] {task['titolo']}{tempo}
   Difficoltà: {task['difficolta']}/10 | Categoria: {task['nome_categoria'] or 'N/A'}
   {task['descrizione'] if task['descrizione'] else ''}
-"""
+""")
         
-        prompt += """
+        prompt = f"""
+Crea un piano di lavoro ottimizzato per il {data}.
+
+📊 PANORAMICA:
+- Totale task: {panoramica['totale']}
+- Task urgenti: {panoramica['urgenti']}
+- Task critici: {panoramica['critici']}
+- Tempo totale stimato: {panoramica['tempo_totale']} ore
+
+📋 TASK DA COMPLETARE:
+""" + ''.join(righe) + """
 
 Crea un piano che:
 1. Inizi con un saluto motivante
@@ -807,22 +1188,15 @@ def task_breakdown_prompt(id_task: int) -> str:
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT a.*, c.nome_categoria
-            FROM appuntamenti a
-            LEFT JOIN categorie c ON a.id_categoria = c.id_categoria
-            WHERE a.id_appuntamento = ?
-        ''', (id_task,))
+        # Il task serve solo da formattare: basta la sqlite3.Row
+        cursor.row_factory = sqlite3.Row
+        cursor.execute(_SQL_TASK_BREAKDOWN, (id_task,))
         
         task = cursor.fetchone()
-        conn.close()
         
         if not task:
             return f"Task {id_task} non trovato"
         
-        task = dict(task)
-        
         return f"""
 Aiutami a scomporre questo task complesso in subtask più gestibili:
 